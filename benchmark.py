@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from datetime import time as day_time
+from database import TripId
+from manager import Manager
+from server import TripsServer
+from test_helpers import fill_db, fetch
+from trip import Trip, EARTH_RADIUS
+
+
+async def client(port, targets, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for target in targets:
+        start = time.perf_counter()
+        await fetch(reader, writer, target)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def load_test(requests=2000, concurrency=20, copies=10, tolerance=5):
+    """
+    Runs trips server on a temporary database and queries it with concurrent clients
+
+    :param int requests: total number of requests
+
+    :param int concurrency: number of concurrent connections
+
+    :param int copies: number of trips in database
+
+    :param float tolerance: simplification tolerance used in points requests
+
+    :return: dict with requests per second and latency percentiles in milliseconds
+
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        manager = Manager(db='sqlite:///' + os.path.join(directory, 'trips_bench.db'), echo=False)
+        fill_db(manager, copies)
+        server = TripsServer(manager, port=0)
+        await server.start()
+
+        paths = ['/trips', '/trips/{}', '/trips/{}/stats', '/trips/{}/points?tolerance=' + str(tolerance)]
+        targets = [paths[i % len(paths)].format(i % copies + 1) for i in range(requests)]
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(client(server.port, targets[i::concurrency], latencies) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        await server.close()
+        manager.db.close()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': requests,
+        'requests_per_second': requests / elapsed,
+        'p50': float(np.percentile(latencies, 50)),
+        'p99': float(np.percentile(latencies, 99)),
+    }
+
+
+def random_route(rng, points=600, step=10, origin=(50.67, 17.97)):
+    """
+    Generates random ride as a walk with slowly changing heading
+
+    :return: pandas.DataFrame with latitude and longtitude columns
+
+    """
+    heading = np.cumsum(rng.normal(0, 0.1, points))
+    start = rng.normal(0, 0.05, 2)
+    lat = origin[0] + start[0] + np.degrees(np.cumsum(step * np.cos(heading)) / EARTH_RADIUS)
+    lon = origin[1] + start[1] + np.degrees(np.cumsum(step * np.sin(heading)) / EARTH_RADIUS / np.cos(np.radians(lat)))
+    return pd.DataFrame({'latitude': lat, 'longtitude': lon})
+
+
+def ride(rng, route, noise=5):
+    """
+    Generates noisy ride of a given route
+
+    :return: Trip
+
+    """
+    noise = np.degrees(rng.normal(0, noise, (len(route), 2)) / EARTH_RADIUS)
+    trip_data = route + noise
+    return Trip(trip_data.assign(speed=20.0, altitude=180.0))
+
+
+def match_benchmark(trips=2000, routes=200, queries=50, seed=0, commute_share=0.0):
+    """
+    Benchmarks finding similar trips in a library of rides of a few repeated routes
+
+    :param int trips: number of trips in database
+
+    :param int routes: number of distinct routes
+
+    :param int queries: number of timed queries
+
+    :param float commute_share: share of rides of the first route, the rest is spread over all routes
+
+    :return: dict with index build time, query latency percentiles in milliseconds, peak memory of a query in MB,
+        recall and precision
+
+    """
+    rng = np.random.default_rng(seed)
+    courses = [random_route(rng) for _ in range(routes)]
+    course_of = np.where(rng.random(trips) < commute_share, 0, rng.integers(0, routes, trips))
+
+    with tempfile.TemporaryDirectory() as directory:
+        manager = Manager(db='sqlite:///' + os.path.join(directory, 'trips_bench.db'), echo=False)
+        session = manager.db.Session()
+        for trip_id, course in enumerate(course_of, 1):
+            fingerprint, track = manager.get_route_data(ride(rng, courses[course]))
+            session.add(TripId(id=trip_id, name=f'Ride {trip_id}', total_time=day_time(0, 30),
+                               fingerprint=fingerprint, track=track))
+        session.commit()
+
+        start = time.perf_counter()
+        manager.get_route_index()
+        build = time.perf_counter() - start
+
+        latencies, recalls, precisions = [], [], []
+        for trip_id in rng.integers(1, trips + 1, queries):
+            start = time.perf_counter()
+            similar = manager.find_similar_trips(int(trip_id))
+            latencies.append(time.perf_counter() - start)
+            expected = set(np.flatnonzero(course_of == course_of[trip_id - 1]) + 1) - {trip_id}
+            found = set(similar['id'])
+            recalls.append(len(expected & found) / len(expected) if expected else 1)
+            precisions.append(len(expected & found) / len(found) if found else 1)
+
+        # tracing slows queries down, memory is measured on a separate query
+        tracemalloc.start()
+        manager.find_similar_trips(int(trip_id))
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        manager.db.close()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'trips': trips,
+        'build': build * 1000,
+        'p50': float(np.percentile(latencies, 50)),
+        'p99': float(np.percentile(latencies, 99)),
+        'memory': memory / 2 ** 20,
+        'recall': float(np.mean(recalls)),
+        'precision': float(np.mean(precisions)),
+    }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmarks of BikeTripsManager')
+    arg_parser.add_argument('--requests', type=int, default=2000)
+    arg_parser.add_argument('--concurrency', type=int, default=20)
+    arg_parser.add_argument('--copies', type=int, default=10)
+    arg_parser.add_argument('--trips', type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    result = asyncio.run(load_test(args.requests, args.concurrency, args.copies))
+    print(f"Server: {result['requests']} requests, {result['requests_per_second']:.0f} req/s, "
+          f"p50 {result['p50']:.2f} ms, p99 {result['p99']:.2f} ms")
+
+    for title, commute_share in [('many routes', 0.0), ('one commute', 0.9)]:
+        result = match_benchmark(args.trips, commute_share=commute_share)
+        print(f"Route matching ({title}): {result['trips']} trips, index built in {result['build']:.0f} ms, "
+              f"p50 {result['p50']:.2f} ms, p99 {result['p99']:.2f} ms, peak {result['memory']:.0f} MB, "
+              f"recall {result['recall']:.2f}, precision {result['precision']:.2f}")
@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+from trip import haversine
+
+
+class CleaningReport:
+    """
+    Report of points dropped while cleaning trip data
+
+    Attributes:
+
+        points: int number of points before cleaning
+
+        dropped: pandas.DataFrame dropped rows with a reason column: 'outlier', 'stationary' or 'resampled'
+
+    """
+
+    def __init__(self, points, dropped):
+        self.points = points
+        self.dropped = dropped
+
+    @property
+    def kept(self):
+        return self.points - len(self.dropped)
+
+    def counts(self):
+        """
+        Counts dropped points by reason
+
+        :return: dict reason: number of dropped points
+
+        """
+        return {reason: int((self.dropped['reason'] == reason).sum())
+                for reason in ('outlier', 'stationary', 'resampled')}
+
+    def __str__(self):
+        counts = ', '.join(f'{reason}: {count}' for reason, count in self.counts().items())
+        return f'kept {self.kept} of {self.points} points ({counts})'
+
+
+class TripCleaner:
+    """
+    Vectorized cleaning of parsed trip data, used before storing trip in database
+
+    Attributes:
+
+        collapse_stationary: bool collapse runs of identical points into the first one,
+        time spent there is stored in the duration column
+
+        max_speed: float maximal plausible speed in km/h, None disables the check
+
+        max_jump: float maximal plausible distance in meters between consecutive points, None disables the check
+
+        min_interval: float minimal time in seconds between stored points, None disables resampling
+
+        max_passes: int maximal number of outlier detection passes
+
+    """
+
+    def __init__(self, collapse_stationary=True, max_speed=100, max_jump=None, min_interval=None, max_passes=5):
+        self.collapse_stationary = collapse_stationary
+        self.max_speed = max_speed
+        self.max_jump = max_jump
+        self.min_interval = min_interval
+        self.max_passes = max_passes
+
+    def clean(self, trip_data):
+        """
+        Drops gps outliers, collapses stationary runs and resamples trip data
+
+        :param pandas.DataFrame trip_data: data parsed by CSVParser
+
+        :return:
+
+            pandas.DataFrame trip_data: cleaned data with additional duration column
+
+            CleaningReport report: dropped points
+
+        """
+        trip_data = trip_data.assign(duration=0.0)
+        seconds = self.get_seconds(trip_data)
+        dropped = []
+
+        outliers = self.find_outliers(trip_data, seconds)
+        dropped.append(trip_data[outliers].assign(reason='outlier'))
+        trip_data, seconds = trip_data[~outliers], seconds[~outliers]
+
+        if self.collapse_stationary and len(trip_data):
+            trip_data, seconds, removed = self.collapse(trip_data, seconds)
+            dropped.append(removed.assign(reason='stationary'))
+
+        if self.min_interval and len(trip_data):
+            trip_data, removed = self.resample(trip_data, seconds)
+            dropped.append(removed.assign(reason='resampled'))
+
+        report = CleaningReport(len(outliers), pd.concat(dropped).drop(columns='duration'))
+        return trip_data.copy(), report
+
+    @staticmethod
+    def get_seconds(trip_data):
+        time = pd.to_datetime(trip_data['time'])
+        return ((time - time.iloc[0]).dt.total_seconds() if len(time) else time).to_numpy(dtype=float)
+
+    def find_outliers(self, trip_data, seconds):
+        """
+        Finds points with impossible speed reading and spikes, points far from both neighbours
+
+        :param pandas.DataFrame trip_data: trip data
+
+        :param numpy.ndarray seconds: time of each point in seconds
+
+        :return: numpy.ndarray boolean mask of outliers
+
+        """
+        outliers = np.zeros(len(trip_data), dtype=bool)
+        if self.max_speed is not None:
+            outliers |= trip_data['speed'].to_numpy() > self.max_speed
+        if self.max_speed is None and self.max_jump is None:
+            return outliers
+
+        lat = trip_data['latitude'].to_numpy(dtype=float)
+        lon = trip_data['longtitude'].to_numpy(dtype=float)
+        for _ in range(self.max_passes):
+            kept = np.flatnonzero(~outliers)
+            if len(kept) < 3:
+                break
+            distance = haversine(lat[kept[:-1]], lon[kept[:-1]], lat[kept[1:]], lon[kept[1:]])
+            bad_step = np.zeros(len(distance), dtype=bool)
+            if self.max_speed is not None:
+                interval = np.maximum(np.diff(seconds[kept]), 1)
+                bad_step |= distance / interval * 3.6 > self.max_speed
+            if self.max_jump is not None:
+                bad_step |= distance > self.max_jump
+
+            # a point is a spike when both steps around it are impossible
+            spikes = np.zeros(len(kept), dtype=bool)
+            spikes[1:-1] = bad_step[:-1] & bad_step[1:]
+            spikes[0] = bad_step[0] and not bad_step[1]
+            spikes[-1] = bad_step[-1] and not bad_step[-2]
+            if not spikes.any():
+                break
+            outliers[kept[spikes]] = True
+        return outliers
+
+    @staticmethod
+    def collapse(trip_data, seconds):
+        """
+        Collapses runs of points with the same latitude, longitude and altitude into the first point of a run
+
+        :return: tuple of collapsed trip data, seconds of kept points, removed rows
+
+        """
+        position = trip_data[['latitude', 'longtitude', 'altitude']].to_numpy()
+        starts = np.ones(len(position), dtype=bool)
+        starts[1:] = (position[1:] != position[:-1]).any(axis=1)
+        first = np.flatnonzero(starts)
+        last = np.append(first[1:] - 1, len(position) - 1)
+
+        collapsed = trip_data.iloc[first].copy()
+        collapsed['duration'] = seconds[last] - seconds[first]
+        return collapsed, seconds[first], trip_data[~starts]
+
+    def resample(self, trip_data, seconds):
+        """
+        Keeps the first point in every min_interval long time window, durations of a window are summed
+
+        :return: tuple of resampled trip data, removed rows
+
+        """
+        window = np.floor(seconds / self.min_interval)
+        starts = np.ones(len(window), dtype=bool)
+        starts[1:] = window[1:] != window[:-1]
+        first = np.flatnonzero(starts)
+
+        resampled = trip_data.iloc[first].copy()
+        resampled['duration'] = np.add.reduceat(trip_data['duration'].to_numpy(), first)
+        return resampled, trip_data[~starts]
+
+
+if __name__ == '__main__':
+    from csv_parser import CSVParser
+    data, cleaning_report = TripCleaner().clean(CSVParser().read_csv_trip_data('Wycieczka 28.04.2021.csv'))
+    print(cleaning_report)
@@ -1,16 +1,27 @@
-from sqlalchemy import create_engine, ForeignKey
+from sqlalchemy import create_engine, ForeignKey, inspect, text, event
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from sqlalchemy import Column, Integer, Float, DateTime, Time, String
+from sqlalchemy import Column, Integer, Float, DateTime, Time, String, LargeBinary
 from datetime import datetime
+import sqlite3
+import threading
 
 Base = declarative_base()
 
+# columns added to tables of databases created by previous versions
+ADDED_COLUMNS = [
+    ('TripData', 'duration', 'FLOAT NOT NULL DEFAULT 0'),
+    ('TripId', 'fingerprint', 'VARCHAR'),
+    ('TripId', 'track', 'BLOB'),
+]
+
 
 class TripId(Base):
     __tablename__ = 'TripId'
     id = Column(Integer, primary_key=True)
     name = Column(String)
     total_time = Column(Time, nullable=False)
+    fingerprint = Column(String)  # geohash sequence of a route, used for route matching
+    track = Column(LargeBinary)  # simplified route resampled to fixed number of points
     trip = relationship('TripData')
 
 
@@ -22,6 +33,7 @@ class TripData(Base):
     altitude = Column(Float, nullable=False)
     speed = Column(Float, nullable=False)
     time = Column(DateTime, nullable=False)
+    duration = Column(Float, nullable=False, server_default='0')  # seconds spent at a collapsed stationary point
     trip_id = Column(Integer, ForeignKey('TripId.id'))
 
 
@@ -35,19 +47,72 @@ class TripsDB:
 
         Session: SQLAlchemy session object
 
+        commits: int number of commits made through engine
+
+        version_connection: sqlite3 connection kept open to read data version of database file
+
     """
 
-    def __init__(self, db='sqlite:///trips.db'):
-        self.engine = create_engine(db, echo=True)
+    def __init__(self, db='sqlite:///trips.db', echo=True):
+        self.engine = create_engine(db, echo=echo)
         self.Session = sessionmaker(bind=self.engine)
+        self.commits = 0
+        event.listen(self.engine, 'commit', self.count_commit)
+        self.version_connection = None
+        self.version_lock = threading.Lock()
         self.create_table()
 
+    def count_commit(self, connection):
+        with self.version_lock:
+            self.commits += 1
+
+    def is_file_database(self):
+        url = self.engine.url
+        return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+            and not url.database.startswith('file:')
+
+    def get_version(self):
+        """
+        Gets version of database content, used to detect inserted and deleted trips.
+        It combines number of commits made through this object with SQLite data version of database file,
+        which changes whenever any other connection, also from another process, commits changes
+
+        :return: tuple int commits, int data version, data version is 0 when database is not an SQLite file
+
+        :raises sqlite3.OperationalError: when database file is locked by another connection
+
+        """
+        with self.version_lock:
+            if not self.is_file_database():
+                return self.commits, 0
+            if self.version_connection is None:
+                # fail fast instead of waiting for a writer holding an exclusive lock
+                self.version_connection = sqlite3.connect(self.engine.url.database, timeout=0.1,
+                                                          check_same_thread=False)
+            return self.commits, self.version_connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        """
+        Closes connection used for reading data version and disposes engine
+
+        """
+        with self.version_lock:
+            if self.version_connection is not None:
+                self.version_connection.close()
+                self.version_connection = None
+        self.engine.dispose()
+
     def create_table(self):
         """
         Creates tables
 
         """
         Base.metadata.create_all(self.engine.connect(), checkfirst=True)
+        insp = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table, column, definition in ADDED_COLUMNS:
+                if column not in [c['name'] for c in insp.get_columns(table)]:
+                    connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
 
     def drop_table(self):
         """
@@ -56,7 +121,7 @@ class TripsDB:
         """
         Base.metadata.drop_all(self.engine.connect(), checkfirst=True)
 
-    def add_trip_id(self, name, total_time):
+    def add_trip_id(self, name, total_time, fingerprint=None, track=None):
         """
         Adds trip to database
 
@@ -64,13 +129,32 @@ class TripsDB:
 
         :param str total_time: total time of a trip
 
+        :param str fingerprint: geohash sequence of a route
+
+        :param bytes track: resampled route
+
         """
         sess = self.Session()
         total_time = datetime.strptime(total_time, '%H:%M:%S').time()
-        row = TripId(name=name, total_time=total_time)
+        row = TripId(name=name, total_time=total_time, fingerprint=fingerprint, track=track)
         sess.add(row)
         sess.commit()
 
+    def set_route(self, trip_id, fingerprint, track):
+        """
+        Sets route fingerprint and track of a trip
+
+        :param int trip_id: trip id
+
+        :param str fingerprint: geohash sequence of a route
+
+        :param bytes track: resampled route
+
+        """
+        sess = self.Session()
+        sess.query(TripId).filter(TripId.id == trip_id).update({'fingerprint': fingerprint, 'track': track})
+        sess.commit()
+
     def check_if_empty(self):
         """
         Checks if TripId table is empty
@@ -1,6 +1,9 @@
 from database import TripsDB, TripData, TripId
 from csv_parser import CSVParser, pd
 from trip import Trip
+from cleaner import TripCleaner
+from routes import RouteIndex, get_route
+import numpy as np
 
 
 class Manager:
@@ -24,48 +27,169 @@ class Manager:
 
         Dictionary to hold all trips from database
 
+        cleaner : TripCleaner object
+
+        Default cleaner of parsed trip data, used when no cleaner is given for an import
+
+        reports : dict
+
+        Dictionary to hold cleaning reports of trips imported in this session
+
+        route_index : RouteIndex object
+
+        Index of routes used for finding similar trips, rebuilt after database content changes
+
+        version : tuple
+
+        Version of database content, changes after every commit made through this manager or, for SQLite files,
+        by other connections and processes. Used to invalidate cached responses and route index
+
 
     Methods:
 
     """
 
-    def __init__(self):
-        self.db = TripsDB()
+    def __init__(self, db='sqlite:///trips.db', echo=True):
+        self.db = TripsDB(db=db, echo=echo)
         self.parser = CSVParser()
         self.trips = {}
+        self.cleaner = TripCleaner()
+        self.reports = {}
+        self.route_index = None
+
+    @property
+    def version(self):
+        return self.db.get_version()
 
-    def populate_db(self, filenames):
+    def populate_db(self, filenames, cleaner=None):
         """
         Creates tables for database and populates using parsed data from files
 
         :param list filenames: list of file names
 
+        :param TripCleaner cleaner: cleaner of parsed data, defaults to cleaner property
+
         """
         session = self.db.Session()
         self.db.create_table()
         if session.query(TripId.id).first() is None:
-            self.populate_trip_data(filenames)
+            self.populate_trip_data(filenames, cleaner)
 
-    def populate_trip_data(self, filenames):
+    def populate_trip_data(self, filenames, cleaner=None):
         """
         Parses data and adds to database
 
         :param filenames: list of file names
 
+        :param TripCleaner cleaner: cleaner of parsed data, defaults to cleaner property
+
         """
         trips = []
         for idx, file in enumerate(filenames):
             file = '/Cycledroid' + '/' + file
             trip_name, trip_total_time = self.parser.read_csv_trip_attributes(file)
-            trip_data = self.parser.read_csv_trip_data(file)
+            trip_data = self.clean_trip_data(self.parser.read_csv_trip_data(file), idx + 1, cleaner)
             trip_data['trip_id'] = idx + 1
             trips.append(trip_data)
-            self.db.add_trip_id(name=trip_name, total_time=trip_total_time)
-            print(f"Adding trip {trip_name} - id:{idx + 1}")
+            fingerprint, track = self.get_route_data(Trip(trip_data))
+            self.db.add_trip_id(name=trip_name, total_time=trip_total_time, fingerprint=fingerprint, track=track)
+            print(f"Adding trip {trip_name} - id:{idx + 1}, {self.reports[idx + 1]}")
 
         combined_trip_data = pd.concat(trips, ignore_index=True, sort=False)
         combined_trip_data.to_sql(name='TripData', con=self.db.engine, if_exists='append', index_label='id')
 
+    def clean_trip_data(self, trip_data, trip_id, cleaner=None):
+        """
+        Cleans parsed trip data and saves cleaning report
+
+        :param pandas.DataFrame trip_data: parsed trip data
+
+        :param int trip_id: id of a trip
+
+        :param TripCleaner cleaner: cleaner of parsed data, defaults to cleaner property
+
+        :return: pandas.DataFrame trip_data: cleaned trip data
+
+        """
+        cleaner = self.cleaner if cleaner is None else cleaner
+        trip_data, self.reports[trip_id] = cleaner.clean(trip_data)
+        return trip_data
+
+    @staticmethod
+    def get_route_data(trip):
+        """
+        Computes route fingerprint and track of a trip for storing in database
+
+        :param Trip trip: trip
+
+        :return: tuple str fingerprint, empty for trips without route, bytes track or None
+
+        """
+        fingerprint, track = get_route(trip)
+        if fingerprint is None:
+            return '', None
+        return fingerprint, track.tobytes()
+
+    def update_routes(self):
+        """
+        Computes route fingerprints and tracks of trips added before route matching was introduced
+
+        """
+        session = self.db.Session()
+        trip_ids = [row.id for row in session.query(TripId.id).filter(TripId.fingerprint.is_(None))]
+        for trip_id in trip_ids:
+            self.db.set_route(trip_id, *self.get_route_data(self.read_trip_data(trip_id)))
+
+    def read_routes(self):
+        """
+        Reads route fingerprints and tracks of all trips from database
+
+        :return: pandas.DataFrame routes: columns id, fingerprint, track
+
+        """
+        session = self.db.Session()
+        sql_query = session.query(TripId.id, TripId.fingerprint, TripId.track). \
+            filter(TripId.fingerprint != '', TripId.track.isnot(None)).order_by(TripId.id).statement
+        with self.db.engine.connect() as connection:
+            routes = pd.read_sql(sql_query, connection)
+
+        return routes
+
+    def get_route_index(self):
+        """
+        Gets route index, builds it when database content changed
+
+        :return: RouteIndex route_index: index of all routes
+
+        """
+        if self.route_index is None or self.route_index.version != self.version:
+            self.update_routes()
+            version = self.version
+            routes = self.read_routes()
+            tracks = [np.frombuffer(track, dtype='f4').reshape(-1, 2) for track in routes['track']]
+            self.route_index = RouteIndex(routes['id'], routes['fingerprint'], tracks, version)
+        return self.route_index
+
+    def find_similar_trips(self, trip_id, max_distance=50, min_overlap=0.5):
+        """
+        Finds trips following the same route as a given trip
+
+        :param int trip_id: trip id
+
+        :param float max_distance: maximal average distance in meters between matched points of two routes
+
+        :param float min_overlap: minimal share of geohash cells which candidate routes have in common
+
+        :return: pandas.DataFrame similar_trips: columns id, name, total_time, distance sorted by distance
+
+        """
+        try:
+            ids, distances = self.get_route_index().find_similar(trip_id, max_distance, min_overlap)
+        except KeyError:
+            ids, distances = [], []
+        similar_trips = pd.DataFrame({'id': ids, 'distance': distances}).astype({'id': int, 'distance': float})
+        return similar_trips.merge(self.read_trips_info(), on='id')[['id', 'name', 'total_time', 'distance']]
+
     def save_all_trips(self):
         """
         Sets trips property using data from database
@@ -106,6 +230,36 @@ class Manager:
 
         return trip_name['name'].item()
 
+    def read_trip_info(self, trip_id):
+        """
+        Reads id, name and total time of a trip from database
+
+        :param int trip_id: trip id
+
+        :return: pandas.DataFrame trip_info: columns id, name, total_time, empty if trip does not exist
+
+        """
+        session = self.db.Session()
+        sql_query = session.query(TripId.id, TripId.name, TripId.total_time).filter(TripId.id == trip_id).statement
+        with self.db.engine.connect() as connection:
+            trip_info = pd.read_sql(sql_query, connection)
+
+        return trip_info
+
+    def read_trips_info(self):
+        """
+        Reads ids, names and total times of all trips from database
+
+        :return: pandas.DataFrame trips_info: columns id, name, total_time
+
+        """
+        session = self.db.Session()
+        sql_query = session.query(TripId.id, TripId.name, TripId.total_time).order_by(TripId.id).statement
+        with self.db.engine.connect() as connection:
+            trips_info = pd.read_sql(sql_query, connection)
+
+        return trips_info
+
     def read_trip_data(self, trip_id):
         """
         Reads trip data from database
@@ -116,8 +270,8 @@ class Manager:
 
         """
         session = self.db.Session()
-        sql_query = session.query(TripData.latitude, TripData.longtitude, TripData.speed, TripData.altitude). \
-            filter_by(trip_id=trip_id).statement
+        sql_query = session.query(TripData.latitude, TripData.longtitude, TripData.speed, TripData.altitude,
+                                  TripData.duration).filter_by(trip_id=trip_id).statement
         with self.db.engine.connect() as connection:
             trip_data = pd.read_sql(sql_query, connection)
 
@@ -137,22 +291,25 @@ class Manager:
 
         return trip_id
 
-    def insert_trips(self, in_file_stream):
+    def insert_trips(self, in_file_stream, cleaner=None):
         """
         Adds new trips to database
 
         :param list in_file_stream: list of file names
 
+        :param TripCleaner cleaner: cleaner of parsed data, defaults to cleaner property
+
         """
         last_trip_id = self.get_last_trip_id()
         trips = []
         for idx, file in enumerate(in_file_stream, 1):
             file = '/Cycledroid' + '/' + file
             trip_name, trip_total_time = self.parser.read_csv_trip_attributes(file)
-            trip_data = self.parser.read_csv_trip_data(file)
+            trip_data = self.clean_trip_data(self.parser.read_csv_trip_data(file), idx + int(last_trip_id), cleaner)
             trip_data['trip_id'] = idx + int(last_trip_id)
             trips.append(trip_data)
-            self.db.add_trip_id(name=trip_name, total_time=trip_total_time)
+            fingerprint, track = self.get_route_data(Trip(trip_data))
+            self.db.add_trip_id(name=trip_name, total_time=trip_total_time, fingerprint=fingerprint, track=track)
 
         combined_trip_data = pd.concat(trips, ignore_index=True, sort=False)
         combined_trip_data.to_sql(name='TripData', con=self.db.engine, if_exists='append', index_label='id',
@@ -167,6 +324,7 @@ class Manager:
         session.query(TripId).delete()
         session.query(TripData).delete()
         session.commit()
+        self.trips = {}
 
 
 if __name__ == '__main__':
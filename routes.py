@@ -0,0 +1,225 @@
+import numpy as np
+from trip import project
+
+BASE32 = np.array(list('0123456789bcdefghjkmnpqrstuvwxyz'))
+GEOHASH_PRECISION = 6  # cells of about 1.2 km x 0.6 km
+TRACK_POINTS = 64
+SIMPLIFY_TOLERANCE = 10  # meters
+FINGERPRINT_SPACING = 100  # meters
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """
+    Encodes gps points as geohashes
+
+    :param lat: array of latitudes in degrees
+
+    :param lon: array of longitudes in degrees
+
+    :param int precision: number of characters of a geohash
+
+    :return: numpy.ndarray of geohash strings, str for a single point
+
+    """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    lat_range = [np.full(lat.shape, -90.0), np.full(lat.shape, 90.0)]
+    lon_range = [np.full(lon.shape, -180.0), np.full(lon.shape, 180.0)]
+    code = np.zeros(lat.shape, dtype=np.int64)
+    for bit in range(5 * precision):
+        value, (low, high) = (lon, lon_range) if bit % 2 == 0 else (lat, lat_range)
+        mid = (low + high) / 2
+        upper = value >= mid
+        low[upper] = mid[upper]
+        high[~upper] = mid[~upper]
+        code = (code << 1) | upper
+    shifts = 5 * np.arange(precision - 1, -1, -1)
+    chars = BASE32[(code[..., None] >> shifts) & 31]
+    geohashes = np.ascontiguousarray(chars).view(f'<U{precision}')[..., 0]
+    return geohashes.item() if geohashes.ndim == 0 else geohashes
+
+
+def get_route(trip, points=TRACK_POINTS, tolerance=SIMPLIFY_TOLERANCE, spacing=FINGERPRINT_SPACING,
+              precision=GEOHASH_PRECISION):
+    """
+    Computes compact description of a trip's route used for route matching
+
+    :param Trip trip: trip
+
+    :param int points: number of points of resampled track
+
+    :param float tolerance: simplification tolerance in meters
+
+    :param float spacing: distance in meters between points encoded in fingerprint
+
+    :param int precision: geohash precision of fingerprint
+
+    :return:
+
+        str fingerprint: concatenated sequence of geohashes visited by a trip, None for trips with less than 2 points
+
+        numpy.ndarray track: float32 array of latitude and longitude of points evenly spaced along simplified route
+
+    """
+    if len(trip.geo) < 2:
+        return None, None
+    keep = trip.get_simplified_mask(tolerance)
+    lat = trip.geo['latitude'].to_numpy(dtype=float)[keep]
+    lon = trip.geo['longtitude'].to_numpy(dtype=float)[keep]
+    xy = trip.get_local_xy()[keep]
+    arc = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(xy, axis=0).T))])
+    if arc[-1] == 0:
+        return geohash_encode(lat[0], lon[0], precision), np.tile([lat[0], lon[0]], (points, 1)).astype('f4')
+
+    positions = np.linspace(0, arc[-1], points)
+    track = np.column_stack([np.interp(positions, arc, lat), np.interp(positions, arc, lon)])
+
+    positions = np.linspace(0, arc[-1], max(2, int(np.ceil(arc[-1] / spacing)) + 1))
+    cells = geohash_encode(np.interp(positions, arc, lat), np.interp(positions, arc, lon), precision)
+    cells = cells[np.concatenate([[True], cells[1:] != cells[:-1]])]
+    return ''.join(cells), track.astype('f4')
+
+
+def dtw_distances(query, candidates, band, max_distance=np.inf, chunk=1024):
+    """
+    Computes dynamic time warping distance between a track and candidate tracks of the same length.
+    Warping path is restricted to Sakoe-Chiba band and only costs inside the band are computed.
+    Candidates which can not be closer than max_distance are abandoned early
+
+    :param numpy.ndarray query: array of shape (n, 2) of x, y coordinates in meters
+
+    :param numpy.ndarray candidates: array of shape (m, n, 2) of x, y coordinates in meters
+
+    :param int band: maximal distance between matched indices
+
+    :param float max_distance: distances above this limit are returned as inf
+
+    :param int chunk: maximal number of candidates processed at once
+
+    :return: numpy.ndarray of m distances, average distance in meters between matched points
+
+    """
+    n = len(query)
+    limit = max_distance * n
+    distances = np.full(len(candidates), np.inf)
+    # every warping path matches first and last points
+    bound = (np.linalg.norm(candidates[:, 0] - query[0], axis=-1) +
+             np.linalg.norm(candidates[:, -1] - query[-1], axis=-1))
+    remaining = np.flatnonzero(bound <= limit)
+    for start in range(0, len(remaining), chunk):
+        rows = remaining[start:start + chunk]
+        distances[rows] = banded_dtw(query, candidates[rows], band, limit)
+    distances[distances > limit] = np.inf
+    return distances / n
+
+
+def banded_dtw(query, candidates, band, limit):
+    """
+    Computes banded dynamic time warping row by row, cell k of a row i matches query point i with candidate point
+    i + k - band. Candidates whose every cell in a row exceeds limit are dropped
+
+    :return: numpy.ndarray of total costs of warping paths, inf for abandoned candidates
+
+    """
+    n, width = len(query), 2 * band + 1
+    offsets = np.arange(-band, band + 1)
+    active = np.arange(len(candidates))
+    costs = np.full(len(candidates), np.inf)
+    # band cells are the first axis so that every cell is a contiguous array over candidates
+    x, y = np.ascontiguousarray(candidates[:, :, 0].T), np.ascontiguousarray(candidates[:, :, 1].T)
+    # row before the first one, only cell matching points before both tracks is reachable
+    previous = np.full((width + 1, len(active)), np.inf)
+    previous[band] = 0
+    for i in range(n):
+        j = i + offsets
+        valid = (j >= 0) & (j < n)
+        cost = np.full((width, len(active)), np.inf)
+        cost[valid] = np.hypot(x[j[valid]] - query[i, 0], y[j[valid]] - query[i, 1])
+
+        # cells above (k + 1 in previous row) and diagonal (k in previous row)
+        above = np.minimum(previous[1:], previous[:-1])
+        current = np.full((width + 1, len(active)), np.inf)
+        for k in range(width):
+            # for k = 0 current[-1] is the padding cell which stays inf
+            np.minimum(above[k], current[k - 1], out=current[k])
+            current[k] += cost[k]
+        previous = current
+
+        alive = current.min(axis=0) <= limit
+        if not alive.all():
+            active, x, y, previous = active[alive], x[:, alive], y[:, alive], previous[:, alive]
+            if not len(active):
+                return costs
+    costs[active] = previous[band]
+    return costs
+
+
+class RouteIndex:
+    """
+    In-memory index of trips' routes for finding repeat rides of the same course.
+    Candidates are prefiltered by overlap of geohash fingerprints and confirmed with banded dynamic time warping
+
+    Attributes:
+
+        ids: numpy.ndarray trip ids
+
+        cells: list of sets of geohashes visited by each trip
+
+        tracks: numpy.ndarray resampled tracks of shape (trips, points, 2)
+
+        version: int manager's version of indexed data
+
+    """
+
+    def __init__(self, ids, fingerprints, tracks, version=0, precision=GEOHASH_PRECISION):
+        self.ids = np.asarray(ids, dtype=int)
+        self.cells = [{fingerprint[i:i + precision] for i in range(0, len(fingerprint), precision)}
+                      for fingerprint in fingerprints]
+        self.tracks = np.stack(tracks) if len(tracks) else np.empty((0, TRACK_POINTS, 2), dtype='f4')
+        self.version = version
+
+    def get_overlaps(self, cells):
+        """
+        Computes Jaccard similarity of geohash sets
+
+        :param set cells: geohashes of a query trip
+
+        :return: numpy.ndarray similarity with every indexed trip
+
+        """
+        return np.array([len(cells & other) / len(cells | other) for other in self.cells])
+
+    def find_similar(self, trip_id, max_distance=50, min_overlap=0.5, band=0.1):
+        """
+        Finds trips following the same route as a given trip
+
+        :param int trip_id: id of an indexed trip
+
+        :param float max_distance: maximal average distance in meters between matched points of two routes
+
+        :param float min_overlap: minimal Jaccard similarity of fingerprints of candidates
+
+        :param float band: width of warping band as a fraction of track length
+
+        :return: tuple of numpy.ndarray ids and numpy.ndarray distances sorted by distance
+
+        """
+        position = np.flatnonzero(self.ids == trip_id)
+        if not len(position):
+            raise KeyError(trip_id)
+        position = position[0]
+
+        candidates = self.get_overlaps(self.cells[position]) >= min_overlap
+        candidates[position] = False
+        if not candidates.any():
+            return np.empty(0, dtype=int), np.empty(0)
+
+        query = self.tracks[position].astype(float)
+        origin = query[0]
+        tracks = project(self.tracks[candidates, :, 0], self.tracks[candidates, :, 1], *origin)
+        distances = dtw_distances(project(query[:, 0], query[:, 1], *origin), tracks,
+                                  max(1, int(band * len(query))), max_distance)
+
+        matched = distances <= max_distance
+        ids, distances = self.ids[candidates][matched], distances[matched]
+        order = np.argsort(distances, kind='stable')
+        return ids[order], distances[order]
@@ -0,0 +1,455 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from manager import Manager
+from settings import Settings
+
+REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+ROUTES = [
+    (re.compile(r'^/trips/?$'), 'query_trips'),
+    (re.compile(r'^/trips/(\d+)/?$'), 'query_trip'),
+    (re.compile(r'^/trips/(\d+)/points/?$'), 'query_points'),
+    (re.compile(r'^/trips/(\d+)/stats/?$'), 'query_stats'),
+]
+
+
+class HTTPError(Exception):
+    """
+    Error returned to client as a json response
+
+    Attributes:
+
+        status: int http status code
+
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ResponseCache:
+    """
+    In-memory LRU cache of serialized responses. Cache is cleared when manager's version changes.
+    Unknown version (None) returns stored responses and stores nothing
+
+    Attributes:
+
+        max_size: int maximal number of stored responses
+
+        version: tuple manager's version of stored responses
+
+        entries: OrderedDict maps request target to tuple of body and etag
+
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.version = None
+        self.entries = OrderedDict()
+
+    def get(self, key, version):
+        """
+        Gets cached response
+
+        :param str key: request target
+
+        :param tuple version: current manager's version, None if it could not be read
+
+        :return: tuple body, etag or None if response is not cached
+
+        """
+        if version is not None and version != self.version:
+            self.entries.clear()
+            self.version = version
+            return None
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, version, entry):
+        """
+        Stores response. Responses computed for outdated version are skipped
+
+        :param str key: request target
+
+        :param tuple version: manager's version from before the query
+
+        :param tuple entry: body and etag
+
+        """
+        if version is None or version != self.version:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class TripsServer:
+    """
+    Local asyncio http server exposing trips from database as json.
+    Database queries are run in a bounded thread pool so the event loop is never blocked
+
+    Endpoints:
+
+        GET /trips - list of trips
+
+        GET /trips/<id> - trip's metadata
+
+        GET /trips/<id>/points?tolerance=<meters> - trip's points, optionally simplified
+
+        GET /trips/<id>/stats - trip's statistics
+
+    Attributes:
+
+        manager: Manager object
+
+        host: str server address
+
+        port: int server port, 0 picks a free port
+
+        executor: ThreadPoolExecutor used for database queries
+
+        cache: ResponseCache object
+
+    """
+
+    def __init__(self, manager, host=Settings.HOST, port=Settings.PORT, workers=Settings.WORKERS, cache_size=256):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='trips-db')
+        self.cache = ResponseCache(cache_size)
+        self.pending = {}
+        self.version_task = None
+        self.server = None
+
+    async def start(self):
+        """
+        Starts listening. Sets port property to the port actually used
+
+        """
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """
+        Stops server and thread pool
+
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def serve_forever(self):
+        """
+        Starts server and serves until cancelled
+
+        """
+        await self.start()
+        print(f'Serving trips on http://{self.host}:{self.port}')
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Handles http/1.1 connection, keep-alive requests are served one after another
+
+        :param reader: asyncio.StreamReader
+
+        :param writer: asyncio.StreamWriter
+
+        """
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HTTPError as e:
+                    writer.write(self.build_response(e.status, self.error_body(str(e)), None, False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, version, headers = request
+                status, body, etag = await self.respond(method, target, headers)
+                keep_alive = self.is_keep_alive(version, headers)
+                writer.write(self.build_response(status, body, etag, keep_alive, method == 'HEAD'))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader):
+        """
+        Reads request line and headers
+
+        :param reader: asyncio.StreamReader
+
+        :return: tuple method, target, http version, dict of headers or None if connection was closed
+
+        :raises HTTPError: 400 for malformed request
+
+        """
+        try:
+            line = await reader.readline()
+            if not line.strip():
+                return None
+            parts = line.decode('latin-1').split()
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                raise HTTPError(400, 'malformed request line')
+            method, target, version = parts
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, colon, value = line.decode('latin-1').partition(':')
+                if not colon:
+                    raise HTTPError(400, 'malformed header')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            # line longer than reader's limit or invalid content length
+            raise HTTPError(400, 'malformed request')
+        if length < 0:
+            raise HTTPError(400, 'malformed request')
+        if length:
+            await reader.readexactly(length)
+        return method, target, version, headers
+
+    @staticmethod
+    def is_keep_alive(version, headers):
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    @staticmethod
+    def build_response(status, body, etag, keep_alive, head=False):
+        """
+        Serializes response
+
+        :return: bytes http response
+
+        """
+        lines = [f'HTTP/1.1 {status} {REASONS[status]}']
+        if etag is not None:
+            lines.append(f'ETag: {etag}')
+            lines.append('Cache-Control: no-cache')
+        if status != 304:
+            lines.append('Content-Type: application/json')
+            lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+        response = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if status != 304 and not head:
+            response += body
+        return response
+
+    async def respond(self, method, target, headers):
+        """
+        Builds response for a request, using cache when possible
+
+        :return: tuple status, body, etag
+
+        """
+        if method not in ('GET', 'HEAD'):
+            return 405, self.error_body('method not allowed'), None
+        try:
+            body, etag = await self.get_response(target)
+        except HTTPError as e:
+            return e.status, self.error_body(str(e)), None
+        except Exception as e:
+            return 500, self.error_body(repr(e)), None
+        if etag in self.parse_etags(headers.get('if-none-match', '')):
+            return 304, b'', etag
+        return 200, body, etag
+
+    async def get_response(self, target):
+        """
+        Gets response body from cache or computes it in thread pool.
+        Concurrent requests for the same target share one query
+
+        :param str target: request target
+
+        :return: tuple body, etag
+
+        """
+        version = await self.read_version()
+        entry = self.cache.get(target, version)
+        if entry is not None:
+            return entry
+        key = (target, version)
+        task = self.pending.get(key)
+        if task is None:
+            handler, args = self.route(target)
+            loop = asyncio.get_running_loop()
+            task = loop.run_in_executor(self.executor, self.render, handler, args)
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        entry = await asyncio.shield(task)
+        self.cache.put(target, version, entry)
+        return entry
+
+    async def read_version(self):
+        """
+        Reads manager's version in thread pool, concurrent requests share one read
+
+        :return: tuple version or None when database is locked by another connection
+
+        """
+        if self.version_task is None:
+            loop = asyncio.get_running_loop()
+            self.version_task = loop.run_in_executor(self.executor, lambda: self.manager.version)
+            self.version_task.add_done_callback(self.clear_version_task)
+        try:
+            return await asyncio.shield(self.version_task)
+        except sqlite3.Error:
+            return None
+
+    def clear_version_task(self, task):
+        if self.version_task is task:
+            self.version_task = None
+
+    def route(self, target):
+        """
+        Matches request target with a query method
+
+        :param str target: request target
+
+        :return: tuple bound method, list of arguments
+
+        """
+        url = urlsplit(target)
+        for pattern, name in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                args = [int(group) for group in match.groups()]
+                if name == 'query_points':
+                    args.append(self.parse_tolerance(url.query))
+                return getattr(self, name), args
+        raise HTTPError(404, f'unknown path {url.path}')
+
+    @staticmethod
+    def parse_tolerance(query):
+        tolerance = parse_qs(query).get('tolerance')
+        if tolerance is None:
+            return None
+        try:
+            tolerance = float(tolerance[-1])
+        except ValueError:
+            raise HTTPError(400, 'tolerance must be a number')
+        if not tolerance >= 0:
+            raise HTTPError(400, 'tolerance must be non-negative')
+        return tolerance
+
+    @staticmethod
+    def parse_etags(header):
+        return {tag.strip().removeprefix('W/') for tag in header.split(',') if tag.strip()}
+
+    @staticmethod
+    def error_body(message):
+        return json.dumps({'error': message}).encode()
+
+    @staticmethod
+    def render(handler, args):
+        """
+        Runs query and serializes its result. Called in thread pool
+
+        :return: tuple body, etag
+
+        """
+        body = json.dumps(handler(*args)).encode()
+        return body, '"' + hashlib.md5(body).hexdigest() + '"'
+
+    def query_trips(self):
+        """
+        :return: list of dicts with trip's id, name and total time
+
+        """
+        trips_info = self.manager.read_trips_info()
+        return [self.trip_info_to_dict(row) for row in trips_info.itertuples(index=False)]
+
+    def query_trip(self, trip_id):
+        """
+        :param int trip_id: trip id
+
+        :return: dict with trip's id, name and total time
+
+        """
+        trip_info = self.manager.read_trip_info(trip_id)
+        if trip_info.empty:
+            raise HTTPError(404, f'trip {trip_id} not found')
+        return self.trip_info_to_dict(next(trip_info.itertuples(index=False)))
+
+    def query_points(self, trip_id, tolerance=None):
+        """
+        :param int trip_id: trip id
+
+        :param float tolerance: simplification tolerance in meters, None returns all points
+
+        :return: dict with trip id, column names and list of points
+
+        """
+        trip = self.read_trip(trip_id)
+        if tolerance is not None:
+            trip = trip.simplify(tolerance)
+        columns = ['latitude', 'longtitude', 'speed', 'altitude', 'duration']
+        points = trip.geo.assign(speed=trip.speed, altitude=trip.altitude, duration=trip.duration)[columns]
+        return {'id': trip_id, 'columns': columns, 'points': points.values.tolist()}
+
+    def query_stats(self, trip_id):
+        """
+        :param int trip_id: trip id
+
+        :return: dict with trip id and statistics
+
+        """
+        return {'id': trip_id, **self.read_trip(trip_id).get_stats()}
+
+    def read_trip(self, trip_id):
+        trip = self.manager.read_trip_data(trip_id)
+        if trip.geo.empty:
+            self.query_trip(trip_id)
+        return trip
+
+    @staticmethod
+    def trip_info_to_dict(row):
+        return {'id': int(row.id), 'name': row.name, 'total_time': str(row.total_time)}
+
+
+def run():
+    """
+    Runs trips server
+
+    """
+    server = TripsServer(Manager(echo=False))
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    run()
@@ -11,9 +11,18 @@ class Settings:
 
         FILES: list of file names
 
+        HOST: str address of a trips server
+
+        PORT: int port of a trips server
+
+        WORKERS: int number of threads used by a trips server for database queries
+
     """
 
     WD = os.getcwd()
+    HOST = '127.0.0.1'
+    PORT = 8080
+    WORKERS = 4
     #FILES = os.listdir(WD+'/'+'Cycledroid')
     try:
         FILES = os.listdir('Cycledroid')
@@ -0,0 +1,53 @@
+import asyncio
+from csv_parser import CSVParser
+
+SAMPLE_FILE = 'Wycieczka 28.04.2021.csv'
+
+
+def fill_db(manager, copies):
+    """
+    Adds sample trip to database several times
+
+    :param Manager manager: manager connected to test database
+
+    :param int copies: number of added trips
+
+    """
+    parser = CSVParser()
+    name, total_time = parser.read_csv_trip_attributes(SAMPLE_FILE)
+    trip_data = parser.read_csv_trip_data(SAMPLE_FILE)
+    for trip_id in range(1, copies + 1):
+        manager.db.add_trip_id(f'{name} #{trip_id}', total_time)
+        trip_data['trip_id'] = trip_id
+        trip_data.to_sql(name='TripData', con=manager.db.engine, if_exists='append', index=False)
+
+
+async def fetch(reader, writer, target, headers=''):
+    """
+    Sends keep-alive GET request and reads response
+
+    :return: tuple status, headers dict, body
+
+    """
+    writer.write(f'GET {target} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n'.encode('latin-1'))
+    await writer.drain()
+    return await read_response(reader)
+
+
+async def read_response(reader):
+    """
+    Reads http response
+
+    :return: tuple status, headers dict, body
+
+    """
+    status = int((await reader.readline()).split()[1])
+    response_headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(response_headers.get('content-length', 0)))
+    return status, response_headers, body
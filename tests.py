@@ -1,12 +1,22 @@
 import unittest
+import asyncio
+import tempfile
 from trip import Trip
 from csv_parser import CSVParser
 import pandas as pd
 import os
+import json
+import sqlite3
+import warnings
 from database import TripsDB
 import sqlalchemy
 from manager import Manager
 from settings import Settings
+from server import TripsServer
+from cleaner import TripCleaner
+from routes import geohash_encode, get_route, dtw_distances, RouteIndex
+import numpy as np
+from test_helpers import fill_db, fetch, read_response
 
 
 class TestCSVParser(unittest.TestCase):
@@ -54,10 +64,36 @@ class TestDatabase(unittest.TestCase):
         self.assertFalse(insp.has_table('TripId'))
         self.assertFalse(insp.has_table('TripData'))
 
+    def test_get_version(self):
+        version = self.test_db.get_version()
+        self.test_db.add_trip_id('Wycieczka 28.04.2021', '01:05:05')
+        self.assertNotEqual(version, self.test_db.get_version())
+        memory_db = TripsDB(db='sqlite://', echo=False)
+        version = memory_db.get_version()
+        memory_db.add_trip_id('Wycieczka 28.04.2021', '01:05:05')
+        self.assertNotEqual(version, memory_db.get_version())
+        memory_db.close()
+
+    def test_close(self):
+        self.test_db.get_version()
+        self.assertIsNotNone(self.test_db.version_connection)
+        self.test_db.close()
+        self.assertIsNone(self.test_db.version_connection)
+
     def test_check_if_empty(self):
         self.test_db.create_table()
         self.assertTrue(self.test_db.check_if_empty())
 
+    def test_add_columns(self):
+        self.test_db.drop_table()
+        with self.test_db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text('CREATE TABLE TripData (id INTEGER PRIMARY KEY, latitude FLOAT)'))
+        self.test_db.create_table()
+        columns = [column['name'] for column in sqlalchemy.inspect(self.test_db.engine).get_columns('TripData')]
+        self.assertIn('duration', columns)
+        columns = [column['name'] for column in sqlalchemy.inspect(self.test_db.engine).get_columns('TripId')]
+        self.assertIn('fingerprint', columns)
+
     def test_add_trip_id(self):
         self.test_db.drop_table()
         self.test_db.create_table()
@@ -105,6 +141,11 @@ class TestManager(unittest.TestCase):
         test_series = pd.Series([1], name='id')
         pd.testing.assert_series_equal(test_series, ids)
 
+    def test_read_trip_info(self):
+        trip_info = self.manager.read_trip_info(1)
+        self.assertEqual(['Wycieczka 28.04.2021'], trip_info['name'].tolist())
+        self.assertTrue(self.manager.read_trip_info(2).empty)
+
     def test_read_trip_name(self):
         name = self.manager.read_trip_name(1)
         test_name = 'Wycieczka 28.04.2021'
@@ -123,6 +164,53 @@ class TestManager(unittest.TestCase):
         self.assertEqual(self.test_saved_trips.keys(), self.manager.trips.keys())
         pd.testing.assert_frame_equal(self.test_saved_trips[1].geo, self.manager.trips[1].geo)
 
+    def test_clean_trip_data(self):
+        trip_data = self.parser.read_csv_trip_data('Wycieczka 28.04.2021.csv')
+        cleaned = self.manager.clean_trip_data(trip_data, 2, TripCleaner(min_interval=5))
+        self.assertEqual(len(cleaned), self.manager.reports[2].kept)
+        self.assertLess(len(cleaned), len(trip_data))
+        cleaned['trip_id'] = 2
+        cleaned.to_sql(name='TripData', con=self.manager.db.engine, if_exists='append', index=False)
+        trip = self.manager.read_trip_data(2)
+        self.assertEqual(len(cleaned), len(trip.geo))
+        self.assertEqual(cleaned['duration'].tolist(), trip.duration.tolist())
+        self.assertEqual(cleaned['duration'].sum(), trip.get_stats()['stopped_time'])
+
+    def test_find_similar_trips(self):
+        trip_data = self.parser.read_csv_trip_data('Wycieczka 28.04.2021.csv')
+        name, total_time = self.parser.read_csv_trip_attributes('Wycieczka 28.04.2021.csv')
+        shifted = trip_data.assign(latitude=trip_data['latitude'] + 0.0001)
+        fingerprint, track = self.manager.get_route_data(Trip(shifted))
+        self.manager.db.add_trip_id(name, total_time, fingerprint, track)
+        reversed_data = trip_data.iloc[::-1]
+        fingerprint, track = self.manager.get_route_data(Trip(reversed_data))
+        self.manager.db.add_trip_id(name, total_time, fingerprint, track)
+
+        similar = self.manager.find_similar_trips(1)
+        self.assertEqual([2], similar['id'].tolist())
+        self.assertLess(similar['distance'].item(), 20)
+        self.assertEqual(name, similar['name'].item())
+        self.assertTrue(self.manager.find_similar_trips(4).empty)
+
+    def test_find_similar_trips_added_by_other_manager(self):
+        self.assertTrue(self.manager.find_similar_trips(1).empty)
+        other = Manager(db=str(self.manager.db.engine.url), echo=False)
+        trip_data = self.parser.read_csv_trip_data('Wycieczka 28.04.2021.csv')
+        fingerprint, track = other.get_route_data(Trip(trip_data))
+        other.db.add_trip_id('Copy', '01:05:05', fingerprint, track)
+        self.assertEqual([2], self.manager.find_similar_trips(1)['id'].tolist())
+        other.db.close()
+
+    def test_find_similar_trips_in_memory_db(self):
+        manager = Manager(db='sqlite://', echo=False)
+        trip_data = self.parser.read_csv_trip_data('Wycieczka 28.04.2021.csv')
+        fingerprint, track = manager.get_route_data(Trip(trip_data))
+        manager.db.add_trip_id('Original', '01:05:05', fingerprint, track)
+        self.assertTrue(manager.find_similar_trips(1).empty)
+        manager.db.add_trip_id('Copy', '01:05:05', fingerprint, track)
+        self.assertEqual([2], manager.find_similar_trips(1)['id'].tolist())
+        manager.db.close()
+
     def test_delete_rows(self):
         self.assertFalse(self.manager.db.check_if_empty())
         self.manager.delete_rows()
@@ -136,4 +224,229 @@ class TestManager(unittest.TestCase):
     def test_populate_db(self):
         self.manager.db.drop_table()
         self.manager.populate_db(filenames=Settings.FILES)
-        self.assertFalse(self.manager.db.check_if_empty())
\ No newline at end of file
+        self.assertFalse(self.manager.db.check_if_empty())
+
+
+class TestTrip(unittest.TestCase):
+    def setUp(self):
+        self.trip = Trip(CSVParser().read_csv_trip_data('Wycieczka 28.04.2021.csv'))
+
+    def test_get_distance(self):
+        self.assertAlmostEqual(14.8, self.trip.get_distance(), delta=0.1)
+
+    def test_get_stats(self):
+        stats = self.trip.get_stats()
+        self.assertEqual(len(self.trip.geo), stats['points'])
+        self.assertEqual(self.trip.speed.max(), stats['speed_max'])
+        self.assertGreaterEqual(stats['altitude_gain'], 0)
+
+    def test_simplify(self):
+        simplified = self.trip.simplify(5)
+        self.assertLess(len(simplified.geo), len(self.trip.geo))
+        pd.testing.assert_frame_equal(self.trip.geo.iloc[[0, -1]], simplified.geo.iloc[[0, -1]])
+        self.assertLessEqual(len(simplified.geo), len(self.trip.simplify(1).geo))
+
+    def test_simplify_duration(self):
+        trip_data = pd.concat([self.trip.geo, self.trip.speed, self.trip.altitude], axis=1).assign(duration=1.0)
+        simplified = Trip(trip_data).simplify(5)
+        self.assertEqual(len(trip_data), simplified.duration.sum())
+        self.assertEqual(len(trip_data), simplified.get_stats()['stopped_time'])
+
+
+class TestTripsServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.manager = Manager(db='sqlite:///' + os.path.join(self.directory.name, 'trips_test.db'), echo=False)
+        fill_db(self.manager, 2)
+        self.server = TripsServer(self.manager, port=0, workers=2)
+        await self.server.start()
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.server.close()
+        self.manager.db.close()
+        self.directory.cleanup()
+
+    async def get(self, target, headers=''):
+        status, response_headers, body = await fetch(self.reader, self.writer, target, headers)
+        return status, response_headers, json.loads(body) if body else None
+
+    async def test_trips(self):
+        status, _, trips = await self.get('/trips')
+        self.assertEqual(200, status)
+        self.assertEqual([1, 2], [trip['id'] for trip in trips])
+        self.assertEqual('01:05:05', trips[0]['total_time'])
+
+    async def test_trip(self):
+        status, _, trip = await self.get('/trips/2')
+        self.assertEqual(200, status)
+        self.assertEqual('Wycieczka 28.04.2021 #2', trip['name'])
+
+    async def test_not_found(self):
+        self.assertEqual(404, (await self.get('/trips/3'))[0])
+        self.assertEqual(404, (await self.get('/trips/3/points'))[0])
+        self.assertEqual(404, (await self.get('/unknown'))[0])
+
+    async def test_points(self):
+        status, _, points = await self.get('/trips/1/points')
+        self.assertEqual(200, status)
+        trip = self.manager.read_trip_data(1)
+        self.assertEqual(len(trip.geo), len(points['points']))
+        self.assertEqual('duration', points['columns'][-1])
+        _, _, simplified = await self.get('/trips/1/points?tolerance=5')
+        self.assertEqual(len(trip.simplify(5).geo), len(simplified['points']))
+        self.assertEqual(400, (await self.get('/trips/1/points?tolerance=abc'))[0])
+
+    async def test_stats(self):
+        status, _, stats = await self.get('/trips/1/stats')
+        self.assertEqual(200, status)
+        self.assertEqual(self.manager.read_trip_data(1).get_stats()['points'], stats['points'])
+
+    async def test_etag(self):
+        _, headers, _ = await self.get('/trips')
+        status, _, body = await self.get('/trips', f'If-None-Match: {headers["etag"]}\r\n')
+        self.assertEqual(304, status)
+        self.assertIsNone(body)
+
+    async def test_cache_invalidation(self):
+        _, headers, _ = await self.get('/trips')
+        self.assertEqual(1, len(self.server.cache.entries))
+        self.manager.delete_rows()
+        status, new_headers, trips = await self.get('/trips', f'If-None-Match: {headers["etag"]}\r\n')
+        self.assertEqual(200, status)
+        self.assertEqual([], trips)
+        self.assertNotEqual(headers['etag'], new_headers['etag'])
+
+    async def test_cache_invalidation_by_other_manager(self):
+        _, headers, _ = await self.get('/trips')
+        other = Manager(db=str(self.manager.db.engine.url), echo=False)
+        other.db.add_trip_id('Other', '00:10:00')
+        status, _, trips = await self.get('/trips', f'If-None-Match: {headers["etag"]}\r\n')
+        self.assertEqual(200, status)
+        self.assertEqual([1, 2, 3], [trip['id'] for trip in trips])
+        other.delete_rows()
+        self.assertEqual([], (await self.get('/trips'))[2])
+        other.db.close()
+
+    async def test_locked_database(self):
+        _, headers, _ = await self.get('/trips')
+        path = self.manager.db.engine.url.database
+        writer = sqlite3.connect(path, isolation_level=None)
+        writer.execute('BEGIN EXCLUSIVE')
+        try:
+            status, _, trips = await asyncio.wait_for(self.get('/trips'), timeout=2)
+        finally:
+            writer.execute('ROLLBACK')
+            writer.close()
+        self.assertEqual(200, status)
+        self.assertEqual([1, 2], [trip['id'] for trip in trips])
+
+    async def test_empty_trip_stats(self):
+        self.manager.db.add_trip_id('Empty', '00:00:00')
+        _, _, empty = await self.get('/trips/3/stats')
+        _, _, stats = await self.get('/trips/1/stats')
+        self.assertEqual(stats.keys(), empty.keys())
+        self.assertEqual(0, empty['points'])
+        self.assertIsNone(empty['speed_max'])
+
+    async def test_malformed_request(self):
+        for request in [b'GARBAGE\r\n\r\n', b'GET /trips HTTP/1.1\r\nContent-Length: abc\r\n\r\n',
+                        b'GET /' + b'a' * 70000 + b' HTTP/1.1\r\n\r\n']:
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+            writer.write(request)
+            await writer.drain()
+            status, headers, _ = await read_response(reader)
+            self.assertEqual(400, status)
+            self.assertEqual('close', headers['connection'])
+            writer.close()
+
+
+class TestTripCleaner(unittest.TestCase):
+    def setUp(self):
+        self.trip_data = pd.DataFrame({
+            'latitude': [50.0, 50.0, 50.0, 50.0001, 51.0, 50.0002, 50.0003],
+            'longtitude': [17.0] * 7,
+            'altitude': [180.0] * 7,
+            'speed': [0.0, 0.0, 0.0, 20.0, 20.0, 20.0, 250.0],
+            'time': pd.date_range('2021-04-28 17:00:00', periods=7, freq='s'),
+        })
+
+    def test_clean(self):
+        cleaned, report = TripCleaner().clean(self.trip_data)
+        self.assertEqual([0, 3, 5], cleaned.index.tolist())
+        self.assertEqual([2.0, 0.0, 0.0], cleaned['duration'].tolist())
+        self.assertEqual({'outlier': 2, 'stationary': 2, 'resampled': 0}, report.counts())
+        self.assertEqual(3, report.kept)
+        self.assertEqual([1, 2, 4, 6], sorted(report.dropped.index))
+
+    def test_resample(self):
+        cleaned, report = TripCleaner(max_speed=None, min_interval=2).clean(self.trip_data)
+        self.assertEqual([0, 3, 4, 6], cleaned.index.tolist())
+        self.assertEqual([2.0, 0.0, 0.0, 0.0], cleaned['duration'].tolist())
+        self.assertEqual({'outlier': 0, 'stationary': 2, 'resampled': 1}, report.counts())
+
+    def test_disabled(self):
+        cleaned, report = TripCleaner(collapse_stationary=False, max_speed=None).clean(self.trip_data)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            cleaned['trip_id'] = 1
+        self.assertEqual(len(self.trip_data), len(cleaned))
+        self.assertEqual(0, len(report.dropped))
+
+    def test_max_jump(self):
+        cleaned, report = TripCleaner(collapse_stationary=False, max_speed=None, max_jump=1000).clean(self.trip_data)
+        self.assertNotIn(4, cleaned.index)
+        self.assertEqual(1, report.counts()['outlier'])
+
+
+class TestRoutes(unittest.TestCase):
+    def setUp(self):
+        self.trip = Trip(CSVParser().read_csv_trip_data('Wycieczka 28.04.2021.csv'))
+
+    def test_geohash_encode(self):
+        self.assertEqual('u4pruydqqvj', geohash_encode(57.64911, 10.40744, 11))
+        self.assertEqual(['u3hb2b', 'u4pruy'], geohash_encode([50.670597, 57.64911], [17.967216, 10.40744]).tolist())
+
+    def test_get_route(self):
+        fingerprint, track = get_route(self.trip, points=32)
+        self.assertEqual(0, len(fingerprint) % 6)
+        self.assertTrue(fingerprint.startswith(geohash_encode(50.670597, 17.967216)))
+        self.assertEqual((32, 2), track.shape)
+        np.testing.assert_allclose(self.trip.geo.iloc[[0, -1]].to_numpy(), track[[0, -1]], atol=1e-5)
+        self.assertEqual((None, None), get_route(Trip(self.trip.geo.head(1).assign(speed=0, altitude=0))))
+
+    def test_dtw_distances(self):
+        query = np.column_stack([np.arange(10.0), np.zeros(10)])
+        candidates = np.stack([query, query + [0, 3], query[::-1]])
+        distances = dtw_distances(query, candidates, band=2)
+        np.testing.assert_allclose([0, 3], distances[:2])
+        self.assertGreater(distances[2], 3)
+        distances = dtw_distances(query, candidates, band=2, max_distance=2)
+        self.assertEqual([0, np.inf, np.inf], distances.tolist())
+
+    def test_dtw_distances_matches_full_table(self):
+        rng = np.random.default_rng(0)
+        query = rng.normal(0, 10, (20, 2))
+        candidates = query + rng.normal(0, 5, (30, 20, 2))
+        band = 3
+        expected = []
+        for candidate in candidates:
+            cost = np.linalg.norm(query[:, None] - candidate[None], axis=-1)
+            dtw = np.full((21, 21), np.inf)
+            dtw[0, 0] = 0
+            for i in range(1, 21):
+                for j in range(max(1, i - band), min(20, i + band) + 1):
+                    dtw[i, j] = cost[i - 1, j - 1] + min(dtw[i - 1, j], dtw[i, j - 1], dtw[i - 1, j - 1])
+            expected.append(dtw[20, 20] / 20)
+        np.testing.assert_allclose(expected, dtw_distances(query, candidates, band, chunk=7))
+
+    def test_find_similar(self):
+        fingerprint, track = get_route(self.trip)
+        trip_data = pd.concat([self.trip.geo, self.trip.speed, self.trip.altitude], axis=1)
+        _, reversed_track = get_route(Trip(trip_data[::-1]))
+        index = RouteIndex([1, 2, 3], [fingerprint] * 3, [track, track + np.float32(0.0001), reversed_track])
+        ids, distances = index.find_similar(1)
+        self.assertEqual([2], ids.tolist())
+        self.assertRaises(KeyError, index.find_similar, 4)
@@ -1,4 +1,34 @@
 from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6371008.8  # meters
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Computes distances between gps points given in degrees
+
+    :return: numpy.ndarray distances in meters
+
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def project(lat, lon, origin_lat, origin_lon):
+    """
+    Projects gps points given in degrees to a local plane (equirectangular projection) around origin
+
+    :return: numpy.ndarray of x, y coordinates in meters, last axis holds x and y
+
+    """
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    origin_lat, origin_lon = np.radians(origin_lat), np.radians(origin_lon)
+    x = (lon - origin_lon) * np.cos(origin_lat) * EARTH_RADIUS
+    y = (lat - origin_lat) * EARTH_RADIUS
+    return np.stack([x, y], axis=-1)
 
 
 class Trip:
@@ -13,6 +43,8 @@ class Trip:
 
         altitude: pandas.Series stores altitude data
 
+        duration: pandas.Series stores time in seconds spent at a point, nonzero for collapsed stationary points
+
 
     Methods:
 
@@ -23,6 +55,10 @@ class Trip:
         self.geo = trip_data[['latitude', 'longtitude']]
         self.speed = trip_data['speed']
         self.altitude = trip_data['altitude']
+        if 'duration' in trip_data:
+            self.duration = trip_data['duration']
+        else:
+            self.duration = pd.Series(0.0, index=trip_data.index, name='duration')
 
     def get_bbox(self):
         """
@@ -46,3 +82,100 @@ class Trip:
 
         """
         return self.geo.apply(lambda x: trip_map.to_pixels(x), axis=1, result_type='expand')
+
+    def get_distance(self):
+        """
+        Computes total distance of a trip using haversine formula
+
+        :return: float distance in kilometers
+
+        """
+        lat = self.geo['latitude'].to_numpy()
+        lon = self.geo['longtitude'].to_numpy()
+        return float(haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]).sum() / 1000)
+
+    def get_stats(self):
+        """
+        Computes summary statistics of a trip
+
+        :return: dict with number of points, distance, stopped time in seconds, speed and altitude statistics,
+            speed and altitude statistics are None for a trip without points
+
+        """
+        empty = self.geo.empty
+        climb = self.altitude.diff()
+        return {
+            'points': int(len(self.geo)),
+            'distance': self.get_distance() if not empty else 0.0,
+            'stopped_time': float(self.duration.sum()),
+            'speed_mean': float(self.speed.mean()) if not empty else None,
+            'speed_max': float(self.speed.max()) if not empty else None,
+            'altitude_min': float(self.altitude.min()) if not empty else None,
+            'altitude_max': float(self.altitude.max()) if not empty else None,
+            'altitude_gain': float(climb[climb > 0].sum()),
+        }
+
+    def simplify(self, tolerance):
+        """
+        Simplifies route using Ramer-Douglas-Peucker algorithm.
+        Durations of removed points are added to the preceding kept point
+
+        :param float tolerance: maximal distance in meters between removed point and simplified route
+
+        :return: Trip simplified trip
+
+        """
+        keep = self.get_simplified_mask(tolerance)
+        trip_data = pd.concat([self.geo, self.speed, self.altitude], axis=1)[keep]
+        if len(keep):
+            trip_data['duration'] = np.add.reduceat(self.duration.to_numpy(dtype=float), np.flatnonzero(keep))
+        return Trip(trip_data)
+
+    def get_simplified_mask(self, tolerance):
+        """
+        Marks points which are kept by Ramer-Douglas-Peucker simplification
+
+        :param float tolerance: maximal distance in meters between removed point and simplified route
+
+        :return: numpy.ndarray boolean mask of kept points
+
+        """
+        points = self.get_local_xy()
+        n = len(points)
+        keep = np.zeros(n, dtype=bool)
+        if n < 3:
+            keep[:] = True
+            return keep
+        keep[0] = keep[-1] = True
+        stack = [(0, n - 1)]
+        while stack:
+            start, end = stack.pop()
+            if end - start < 2:
+                continue
+            segment = points[end] - points[start]
+            offsets = points[start + 1:end] - points[start]
+            length = np.hypot(*segment)
+            if length == 0:
+                distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            else:
+                distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+            idx = int(distances.argmax())
+            if distances[idx] > tolerance:
+                split = start + 1 + idx
+                keep[split] = True
+                stack.append((start, split))
+                stack.append((split, end))
+        return keep
+
+    def get_local_xy(self):
+        """
+        Projects gps data to a local plane (equirectangular projection)
+
+        :return: numpy.ndarray of x, y coordinates in meters
+
+        """
+        lat = self.geo['latitude'].to_numpy(dtype=float)
+        lon = self.geo['longtitude'].to_numpy(dtype=float)
+        if len(lat) == 0:
+            return np.empty((0, 2))
+        return project(lat, lon, lat[0], lon[0])